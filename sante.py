@@ -12,16 +12,22 @@ b) else :
 3) verifies that the ages of death are respected
 """
 
+import os
 import re
 import sys
+import argparse
+import sqlite3
+import hashlib
 import traceback
 import urllib.request
 import time
 from math import ceil
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
 import numpy as np
 import datetime
 import logging
+from collections import namedtuple
 import dateparser
 
 logging.getLogger().setLevel(logging.DEBUG)
@@ -37,41 +43,94 @@ INTRO = "Liste des joueurs:<br/>"
 ENDING = "<br/>Programme tourné le: "
 SANTE = ["né le <date>", "1er comptage", *["{}ème comptage".format(i) for i in range(2, 9)],
          "Excellente santé", "Bonne santé", "Mauvaise santé", "Mort à venir", "Mort"]
+EXCEPT_RE = re.compile(r'except : thread (\d+) page (\d+) message (\d+)')
+MUXXU_GROUP_RE = re.compile(r'groupe muxxu : &quot;(.*?)&quot; ; carte : (\d+) ; ville : (\d+)')
+HISTORY_DB = "historique.sqlite3"
+# persisted history of the players, queried through "python sante.py query ..."
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    muxxu_id INTEGER PRIMARY KEY,
+    twino_id INTEGER,
+    name TEXT
+);
+CREATE INDEX IF NOT EXISTS players_twino_id ON players (twino_id);
+CREATE INDEX IF NOT EXISTS players_name ON players (name);
+CREATE TABLE IF NOT EXISTS states (
+    muxxu_id INTEGER NOT NULL REFERENCES players (muxxu_id),
+    time TEXT NOT NULL,
+    year INTEGER,
+    month INTEGER,
+    health INTEGER,
+    map INTEGER,
+    thread INTEGER,
+    page INTEGER,
+    PRIMARY KEY (muxxu_id, time)
+) WITHOUT ROWID;
+DROP INDEX IF EXISTS states_time;
+CREATE INDEX IF NOT EXISTS states_health_time ON states (health, time);
+CREATE INDEX IF NOT EXISTS states_health_map_time ON states (health, map, time);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+DROP TABLE IF EXISTS inputs;
+CREATE TABLE IF NOT EXISTS excepts (
+    thread INTEGER NOT NULL,
+    page INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (thread, page, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS renders (
+    muxxu_id INTEGER PRIMARY KEY,
+    digest TEXT NOT NULL
+);
+"""
+GRAPHS_DIR = "graphes"
+OVERVIEW_GRAPH = "joueurs.png"
 
 
 # classes
 
-class MessageExcept:
+class MessageExcept(namedtuple("MessageExcept", ["thread", "page", "position"])):
     """ Messages of the forum that does NOT have to be processed (because wrong or whatever).
     These exceptions are reported in the twinoïd page, in the form :
     except : thread <thread number (see URL)> page <page number> message <position in terms of content.split(INTRO)[1:]>
     Can be initialised through "s" (following the above format) or by specifying each element of it.
+    Immutable and hashable: equal (and hashing the same) as the tuple (<thread>, <page>, <pos>).
     """
-    def __init__(self, thread=None, page=None, position=None, s=None):
-        if s is not None:
-            datas = re.search('except : thread (\d+) page (\d+) message (\d+)', s)
-            self.thread = int(datas.group(1))
-            self.page = int(datas.group(2))
-            self.position = int(datas.group(3))
-        else:
-            self.thread = thread
-            self.page = page
-            self.position = position
+    __slots__ = ()
 
-    def __eq__(self, other):
-        """To be able to do e.g. "(<thread>, <page>, <pos>) in <list of MessageExcept>" """
-        if isinstance(other, MessageExcept):
-            thread, page, position = other.thread, other.page, other.position
-        elif isinstance(other, tuple):
-            thread, page, position = other
-        else:
-            raise RuntimeError("Impossible comparison of MessageExcept with {}".format(type(other)))
-        return self.thread == thread and self.page == page and self.position == position
+    def __new__(cls, thread=None, page=None, position=None, s=None):
+        if s is not None:
+            datas = EXCEPT_RE.search(s)
+            if not datas:
+                raise ValueError("Input line is not in the expected format: {}".format(s))
+            thread, page, position = int(datas.group(1)), int(datas.group(2)), int(datas.group(3))
+        return super().__new__(cls, thread, page, position)
 
     def __repr__(self):
         return "<MessageExcept: thread {}, page {}, position {}>".format(self.thread, self.page, self.position)
 
 
+class ExceptSet(frozenset):
+    """ Frozen set of MessageExcept, so that "(<thread>, <page>, <pos>) in <ExceptSet>" is a hash lookup.
+    Also indexed by (thread, page), to get all the excepted positions of a forum page at once."""
+    def __new__(cls, excepts=()):
+        self = super().__new__(cls, excepts)
+        by_page = {}
+        for except_ in self:
+            by_page.setdefault((except_.thread, except_.page), set()).add(except_.position)
+        self._by_page = {key: frozenset(positions) for key, positions in by_page.items()}
+        return self
+
+    def positions(self, thread, page):
+        """ Positions of the messages to be ignored in the given page of the given thread."""
+        return self._by_page.get((thread, page), frozenset())
+
+    def __repr__(self):
+        return "<ExceptSet: {}>".format(sorted(self))
+
+
 class ForumSource:
     """ Contains the raw code of a page of the forum, as well as the thread and page numbers it comes from."""
     def __init__(self, thread, page, content):
@@ -94,29 +153,41 @@ class RankingSource:
         return "<RankingSource: map {} page {}>".format(self.map, self.page)
 
 
-class MuxxuGroup:
+class MuxxuGroup(namedtuple("MuxxuGroup", ["group", "map", "city"])):
     """ Represents a muxxu group, with its name (self.group), map number and a (random) city on that map.
     These groups are reported in the twinoïd page, in the form :
     groupe muxxu : "<name>" ; carte : <map number> ; ville : <city number>
     Can be initialised through "s" (following the above format) or by specifying each element of it.
+    Immutable and hashable, like MessageExcept.
     """
-    def __init__(self, group=None, map_=None, city=None, s=None):
+    __slots__ = ()
+
+    def __new__(cls, group=None, map_=None, city=None, s=None):
         if s is not None:
-            datas = re.search(r'groupe muxxu : &quot;(.*?)&quot; ; carte : (\d+) ; ville : (\d+)', s)
-            self.group = datas.group(1)
-            self.map = int(datas.group(2))
-            self.city = int(datas.group(3))
-        else:
-            self.group = group
-            self.map = int(map_)
-            self.city = int(city)
-        if not all([c.isalnum() or c in "-_" for c in self.group]):
-            raise RuntimeError("Nom de groupe muxxu inattendu: {}.".format(self.group))
+            datas = MUXXU_GROUP_RE.search(s)
+            if not datas:
+                raise ValueError("Input line is not in the expected format: {}".format(s))
+            group, map_, city = datas.group(1), datas.group(2), datas.group(3)
+        if not all([c.isalnum() or c in "-_" for c in group]):
+            raise RuntimeError("Nom de groupe muxxu inattendu: {}.".format(group))
+        return super().__new__(cls, group, int(map_), int(city))
 
     def __repr__(self):
         return "<MuxxuGroup: group {}>".format(self.group)
 
 
+class InputConfig(namedtuple("InputConfig", ["muxxu_groups", "threads", "excepts", "digest"])):
+    """ Compiled content of the twinoïd page: tuple of MuxxuGroup, tuple of thread numbers, ExceptSet,
+    and the sha1 digest of the raw data it was parsed from.
+    The digest changes whenever the page does, and is stored with the history by save_history, which also uses
+    the excepts to know which stored forum states went stale."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "<InputConfig {}: {} groups, threads {}, {} excepts>".format(
+            self.digest[:8], len(self.muxxu_groups), list(self.threads), len(self.excepts))
+
+
 class Player:
     """Represents a player, with all its states.
     Its muxxu_id is considered as unique and is therefore used as a bijection between ids and players.
@@ -166,10 +237,13 @@ class PlayerState:
     [other stuffs]-[years].[month] : [health]
     (depending on health value)
     Can be initialised through "s" (following the above format) or by specifying each element of it.
-    Whichever is chosen, time has to be given separately.
+    Whichever is chosen, time has to be given separately, as well as the map (only known from the map history
+    and the rankings, None otherwise) and the source, i.e. the (thread, page) of the forum it was read from.
     """
-    def __init__(self, time=None, year=None, month=None, health=None, s=None):
+    def __init__(self, time=None, year=None, month=None, health=None, s=None, map_=None, source=None):
         self.time = time
+        self.map = map_
+        self.source = source
         if s is None:
             self.year = year
             self.month = month
@@ -238,30 +312,280 @@ def get_threshold(days):
     return 9 + 3 * (days // 10)
 
 
+# history
+
+def open_history(path=HISTORY_DB, read_only=False):
+    """ Opens (and creates if needed) the sqlite database where the players history is stored.
+    If read_only, the database has to exist and is neither created nor modified."""
+    if read_only:
+        return sqlite3.connect("file:{}?mode=ro".format(urllib.request.pathname2url(os.path.abspath(path))), uri=True)
+    connection = sqlite3.connect(path)
+    connection.executescript(HISTORY_SCHEMA)
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(states)")]
+    for column in ("thread", "page"):  # databases created before the source of the states was stored
+        if column not in columns:
+            connection.execute("ALTER TABLE states ADD COLUMN {} INTEGER".format(column))
+    return connection
+
+
+def save_history(players, path=HISTORY_DB, config=None, threads=None):
+    """ Stores every player of the dict {<muxxu_id>: <Player>} and all its states in the history database.
+    States already stored at the same time are updated, except for a known map which is kept when the new state
+    doesn't know it (births read from the forum, or no longer in the map history).
+    config is the InputConfig used to read the forum threads "threads" (config.threads by default): the stored states
+    read from a page of these threads whose excepted messages changed since the last save are stale, and are
+    replaced by the new ones. Stored states of the other threads and pages are kept as they are."""
+    with open_history(path) as connection:
+        if config is not None:
+            threads = sorted(set(config.threads if threads is None else threads))
+            marks = ", ".join("?" * len(threads))
+            stored = set(connection.execute(
+                "SELECT thread, page, position FROM excepts WHERE thread IN ({})".format(marks), threads))
+            excepts = {tuple(except_) for except_ in config.excepts if except_.thread in threads}
+            stale = sorted({(thread, page) for thread, page, _ in stored ^ excepts})
+            if stale:
+                logging.info("Messages exclus modifiés, états du forum remplacés pour {}".format(stale))
+                connection.executemany("DELETE FROM states WHERE thread = ? AND page = ?", stale)
+            connection.execute("DELETE FROM excepts WHERE thread IN ({})".format(marks), threads)
+            connection.executemany("INSERT INTO excepts (thread, page, position) VALUES (?, ?, ?)", sorted(excepts))
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('inputs_digest', ?)",
+                               (config.digest,))
+        connection.executemany(
+            "INSERT OR REPLACE INTO players (muxxu_id, twino_id, name) VALUES (?, ?, ?)",
+            [(player.muxxu_id, player.twino_id, player.name) for player in players.values()])
+        connection.executemany(
+            "INSERT INTO states (muxxu_id, time, year, month, health, map, thread, page) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (muxxu_id, time) DO UPDATE SET year = excluded.year, month = excluded.month, "
+            "health = excluded.health, map = COALESCE(excluded.map, states.map), "
+            "thread = COALESCE(excluded.thread, states.thread), page = COALESCE(excluded.page, states.page)",
+            [(player.muxxu_id, state.time.isoformat(sep=" "), state.year, state.month, state.health, state.map,
+              *(state.source or (None, None)))
+             for player in players.values() for state in player.states.values()])
+    connection.close()
+    logging.debug("History saved in {}".format(path))
+
+
+def read_history(connection, where, params=(), players_first=False):
+    """ Reads the states matching the sql condition "where" (on "players p" and "states s").
+    If players_first, sqlite is forced to loop over the players and look their states up (CROSS JOIN),
+    instead of choosing by itself.
+    Returns the list of matching Player (sorted by name), with only the matching states."""
+    players = {}
+    rows = connection.execute(
+        "SELECT p.muxxu_id, p.twino_id, p.name, s.time, s.year, s.month, s.health, s.map "
+        "FROM {} ON p.muxxu_id = s.muxxu_id WHERE {} ORDER BY s.muxxu_id, s.time"
+        "".format("players p CROSS JOIN states s" if players_first else "states s JOIN players p", where), params)
+    for muxxu_id, twino_id, name, time_, year, month, health, map_ in rows:
+        if muxxu_id not in players:
+            players[muxxu_id] = Player(muxxu_id, twino_id, name)
+        time_ = datetime.datetime.fromisoformat(time_)
+        players[muxxu_id].states[time_] = PlayerState(time_, year, month, health, map_=map_)
+    return sorted(players.values(), key=lambda x: x.name)
+
+
+def query_player(connection, muxxu_id=None, twino_id=None, name=None):
+    """ Full history of the players with the given muxxu id, twinoïd id or name prefix."""
+    if muxxu_id is not None:
+        return read_history(connection, "s.muxxu_id = ?", (muxxu_id,))
+    if twino_id is not None:
+        return read_history(connection, "s.muxxu_id IN (SELECT muxxu_id FROM players WHERE twino_id = ?)",
+                            (twino_id,))
+    # range on the index rather than LIKE, which sqlite can't run on the (case sensitive) index
+    return read_history(connection, "s.muxxu_id IN (SELECT muxxu_id FROM players WHERE name >= ? AND name < ?)",
+                        (name, name + "\U0010ffff"))
+
+
+def query_health(connection, health, date):
+    """ Players having the given health on the given date, i.e. whose last known health at the end of that date is
+    the given one (even if nothing was posted on that date), with that last state."""
+    end = datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time()).isoformat(sep=" ")
+    # for each player, seek its last known state on the primary key, then filter on its health
+    return read_history(connection, "s.time = (SELECT time FROM states WHERE muxxu_id = p.muxxu_id AND time < ? "
+                                    "AND health IS NOT NULL ORDER BY time DESC LIMIT 1) AND s.health = ?",
+                        (end, health), players_first=True)
+
+
+def query_births(connection, start, end, map_=None):
+    """ Players (with their births) born between the dates start (included) and end (excluded),
+    on any map or only on map_ if given."""
+    start = datetime.datetime.combine(start, datetime.time()).isoformat(sep=" ")
+    end = datetime.datetime.combine(end, datetime.time()).isoformat(sep=" ")
+    if map_ is None:
+        return read_history(connection, "s.health = 0 AND s.time >= ? AND s.time < ?", (start, end))
+    return read_history(connection, "s.health = 0 AND s.map = ? AND s.time >= ? AND s.time < ?", (map_, start, end))
+
+
+def describe_state(state):
+    """ One line describing a PlayerState, as printed by the "query" subcommand."""
+    health = "?" if state.health is None else "naissance" if state.health == 0 else SANTE[state.health]
+    return "{} : {} à {}.{:02d}{}".format(state.time.strftime("%d-%m-%Y %H:%M:%S"), health, state.year,
+                                          state.month or 0, "" if state.map is None else " (carte {})".format(state.map))
+
+
+def run_query(args):
+    """ Prints the answer of the "query" subcommand, only reading the history database."""
+    connection = open_history(args.history, read_only=True)
+    if args.query == "player":
+        players = query_player(connection, args.muxxu_id, args.twino_id, args.name)
+    elif args.query == "health":
+        players = query_health(connection, args.health, args.date)
+    else:
+        players = query_births(connection, args.start, args.end, args.map)
+    connection.close()
+    for player in players:
+        print("@{}:{} ({})".format(player.name, player.twino_id, player.muxxu_id))
+        for state_time in sorted(player.states):
+            print("    {}".format(describe_state(player.states[state_time])))
+    if not players:
+        print("Aucun joueur trouvé.")
+
+
+# report
+
+class PlayerSeries:
+    """ Age and health history of a player as NumPy arrays (health is nan when unknown, i.e. from the rankings),
+    with the digest of that history to know whether its graph has to be rendered again."""
+    def __init__(self, player):
+        states = [player.states[state_time] for state_time in sorted(player.states)]
+        self.muxxu_id = player.muxxu_id
+        self.label = "{} ({})".format(player.name, player.muxxu_id)
+        self.times = np.array([state.time.replace(tzinfo=None) for state in states], dtype="datetime64[s]")
+        self.ages = np.array([state.year + (state.month or 0) / 12.0 for state in states])
+        self.healths = np.array([np.nan if state.health is None else state.health for state in states])
+        self.digest = hashlib.sha1(repr((self.label, [(state.time, state.year, state.month, state.health, state.map)
+                                                      for state in states])).encode("utf8")).hexdigest()
+
+    def __repr__(self):
+        return "<PlayerSeries {}: {} states>".format(self.label, len(self.times))
+
+
+def render_player(series, path):
+    """ Renders the compact graph of a single player (age curve, points coloured by health) in path."""
+    fig = Figure(figsize=(4, 2.5), dpi=80)
+    ax = fig.add_subplot()
+    ax.plot(series.times, series.ages, color="grey", linewidth=1)
+    known = ~np.isnan(series.healths)
+    points = ax.scatter(series.times[known], series.ages[known], c=series.healths[known], s=12,
+                        cmap="RdYlGn_r", vmin=0, vmax=len(SANTE) - 1)
+    fig.colorbar(points, ax=ax, ticks=[0, SANTE.index("Excellente santé"), len(SANTE) - 1])
+    ax.set_title(series.label, fontsize=9)
+    ax.set_ylabel("âge", fontsize=8)
+    ax.tick_params(labelsize=6)
+    fig.autofmt_xdate()
+    fig.savefig(path)
+    return series.muxxu_id, series.digest
+
+
+def render_overview(all_series, path, labelled=20):
+    """ Renders the age curves of all the players in a single graph, only the "labelled" oldest ones in the legend."""
+    fig = Figure(figsize=(10, 6), dpi=80)
+    ax = fig.add_subplot()
+    for i, series in enumerate(sorted(all_series, key=lambda x: -x.ages[-1])):
+        if i < labelled:
+            ax.plot(series.times, series.ages, linewidth=1, label=series.label)
+        else:
+            ax.plot(series.times, series.ages, linewidth=0.5, color="lightgrey", zorder=0)
+    ax.legend(loc="upper left", fontsize=6)
+    ax.set_ylabel("âge")
+    fig.autofmt_xdate()
+    fig.savefig(path)
+
+
+def report(path=HISTORY_DB, output=GRAPHS_DIR):
+    """ Renders one graph per player from the history database, plus an overview of all of them,
+    only for the players whose history changed since the last report (the graphs are rendered in parallel)."""
+    os.makedirs(output, exist_ok=True)
+    connection = open_history(path)
+    all_series = [PlayerSeries(player) for player in read_history(connection, "1")]
+    if not all_series:
+        logging.warning("Aucun historique trouvé dans {}".format(path))
+        connection.close()
+        return
+    rendered = dict(connection.execute("SELECT muxxu_id, digest FROM renders"))
+    changed = [series for series in all_series
+               if rendered.get(series.muxxu_id) != series.digest
+               or not os.path.exists(os.path.join(output, "{}.png".format(series.muxxu_id)))]
+    logging.info("{} graphes à mettre à jour sur {} joueurs".format(len(changed), len(all_series)))
+    overview_path = os.path.join(output, OVERVIEW_GRAPH)
+    if changed or not os.path.exists(overview_path):
+        with ProcessPoolExecutor() as executor:
+            overview = executor.submit(render_overview, all_series, overview_path)
+            renders = list(executor.map(render_player, changed,
+                                        [os.path.join(output, "{}.png".format(series.muxxu_id)) for series in changed],
+                                        chunksize=max(1, len(changed) // (4 * (os.cpu_count() or 1)))))
+            overview.result()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO renders (muxxu_id, digest) VALUES (?, ?)", renders)
+    connection.close()
+
+
+def parse_args(argv):
+    """ Parses the command line: no subcommand to verify the forum, "query ..." or "report"."""
+    def date(s):
+        return datetime.datetime.strptime(s, "%d-%m-%Y").date()
+
+    def health(s):
+        return int(s) if s.isdigit() else SANTE.index(s)
+
+    parser = argparse.ArgumentParser(description="Verifies the messages of the forum (without subcommand) "
+                                                 "or queries the stored history of the players.")
+    parser.add_argument("--history", default=HISTORY_DB, help="history database (default: %(default)s)")
+    subparsers = parser.add_subparsers(dest="command")
+    query = subparsers.add_parser("query", help="query the history of the players, without using the network")
+    queries = query.add_subparsers(dest="query")
+    queries.required = True
+    player = queries.add_parser("player", help="full history of a player")
+    who = player.add_mutually_exclusive_group(required=True)
+    who.add_argument("--muxxu-id", type=int)
+    who.add_argument("--twino-id", type=int)
+    who.add_argument("--name", help="prefix of the name")
+    by_health = queries.add_parser("health", help="players having a given health on a given date")
+    by_health.add_argument("health", type=health, help='index or name in SANTE, e.g. "Mauvaise santé"')
+    by_health.add_argument("date", type=date, help="dd-mm-yyyy")
+    births = queries.add_parser("births", help="players born between two dates")
+    births.add_argument("start", type=date, help="dd-mm-yyyy (included)")
+    births.add_argument("end", type=date, help="dd-mm-yyyy (excluded)")
+    births.add_argument("--map", type=int)
+    graphs = subparsers.add_parser("report", help="render the graphs of the players whose history changed")
+    graphs.add_argument("--output", default=GRAPHS_DIR, help="directory of the graphs (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
 # main functions
 
 def get_inputs():
-    """Get inputs from the twinoïd page. (muxxu groups, thread of the forum and exceptions)"""
-    muxxu_groups = []
-    threads = []
-    excepts = []
-
+    """Get inputs from the twinoïd page. (muxxu groups, thread of the forum and exceptions)
+    Returns an InputConfig, whose digest is stored with the history by save_history."""
     source_code = get_source_code('https://twinoid.com/mod/group/10562/donnees-pour-tourner-le-code?'
                                   'jsm=1;host=twinoid.com;sid={}'.format(SID))
     for line_code in source_code.split("\n"):
         if '<div class="editorContent">' in line_code:
             data_string = between("<pre>", line_code, "</pre>")
-            for data_line in data_string.split("\\n"):
-                if data_line.startswith("groupe muxxu : "):
-                    muxxu_groups.append(MuxxuGroup(s=data_line))
-                elif data_line.startswith("thread : "):
-                    threads.append(int(data_line[9:]))
-                elif data_line.startswith("except : "):
-                    excepts.append(MessageExcept(s=data_line))
             break
     else:
         raise RuntimeError("Input not found.")
-    return muxxu_groups, threads, excepts
+    return parse_inputs(data_string)
+
+
+def parse_inputs(data_string):
+    """ Parses the data of the twinoïd page into an InputConfig."""
+    muxxu_groups = []
+    threads = []
+    excepts = []
+    for data_line in data_string.split("\\n"):
+        if data_line.startswith("groupe muxxu : "):
+            muxxu_groups.append(MuxxuGroup(s=data_line))
+        elif data_line.startswith("thread : "):
+            thread = int(data_line[9:])
+            if thread not in threads:
+                threads.append(thread)
+        elif data_line.startswith("except : "):
+            excepts.append(MessageExcept(s=data_line))
+    config = InputConfig(tuple(muxxu_groups), tuple(threads), ExceptSet(excepts),
+                         hashlib.sha1(data_string.encode("utf8")).hexdigest())
+    logging.debug("Parsed inputs {}".format(config))
+    return config
 
 
 def get_from_forum(threads):
@@ -287,7 +611,7 @@ def read_forum_sources(forum_sources, excepts):
     """ Reads the forum to check the posted messages and extract players information.
 
     :param forum_sources: list of ForumSource objects, the forum to be analysed (has to be in chronological order)
-    :param excepts: list of MessageExcept objects, parts of the forum to be ignored
+    :param excepts: ExceptSet of MessageExcept objects, parts of the forum to be ignored
     :return: dict of {<muxxu_id>: <Player>} with their states completed thanks to the information of the forum,
         as well as the time of the last message on the forum
     """
@@ -296,9 +620,10 @@ def read_forum_sources(forum_sources, excepts):
     players = {}
     last_date = datetime.datetime(2000, 1, 1)
     for forum_source in forum_sources:
+        skipped = excepts.positions(forum_source.thread, forum_source.page)
         for i, message in enumerate(forum_source.content.split(INTRO)[1:]):
             message = message.partition("</div>")[0]
-            if (forum_source.thread, forum_source.page, i) in excepts:
+            if i in skipped:
                 logging.debug("Message skipped: {}".format(message.replace("\n", " ")))
                 continue
 
@@ -335,7 +660,8 @@ def read_forum_sources(forum_sources, excepts):
                 player = Player(s=player_line)
                 if player.muxxu_id in players:
                     player = players[player.muxxu_id]
-                player.states[message_time] = PlayerState(time=message_time, s=player_line)
+                player.states[message_time] = PlayerState(time=message_time, s=player_line,
+                                                           source=(forum_source.thread, forum_source.page))
                 born = re.search('né le (.*?)$', player_line)
                 if born:
                     date_born = datetime.datetime.strptime(born.group(1), "%d-%m-%Y %H:%M:%S")
@@ -363,8 +689,9 @@ def get_map_histo(muxxu_groups, players):
             if date in player.states:
                 if player.states[date].health != 0:  # TODO: Might be a big problem :D.
                     raise RuntimeError("Deux états à la même seconde, contacte @simoons:528629 pour régler ça stp.")
+                player.states[date].map = muxxu_group.map
                 continue
-            player.states[date] = PlayerState(date, 20, 0, 0)
+            player.states[date] = PlayerState(date, 20, 0, 0, map_=muxxu_group.map)
 
 
 def get_rankings(muxxu_groups):
@@ -401,7 +728,7 @@ def read_ranking_sources(ranking_sources, players, now):
             age = re.search("(\d+) ans(?: et (\d+) mois)?", player_str)
             year, month = int(age.group(1)), int(age.group(2) or 0)
             assert max(player.states) < now, "Une donnée d'un temps futur a été trouvée, ce qui est inattendu..."
-            player.states[now] = PlayerState(now, year, month, None)
+            player.states[now] = PlayerState(now, year, month, None, map_=ranking_source.map)
 
 
 def write_message(players, now):
@@ -460,9 +787,19 @@ def checks(now, last_date, players):
                       "Les dernières données récoltées semblent provenir d'après l'instant présent.")
 
 
-def main():
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.command is not None and not os.path.exists(args.history):
+        sys.exit("Historique introuvable : {}".format(args.history))
+    if args.command == "query":
+        run_query(args)
+        return
+    if args.command == "report":
+        report(args.history, args.output)
+        return
     add = 10  # used to do the simulations on the forum. Should be removed once validated
-    muxxu_groups, threads, excepts = get_inputs()
+    config = get_inputs()
+    muxxu_groups, threads, excepts = config.muxxu_groups, config.threads, config.excepts
     # logging.debug("{}, {}, {}".format(muxxu_groups, threads, excepts))
     threads = [64592595]  # used to do the simulations on the forum. Should be removed once validated
     forum_sources = get_from_forum(threads)
@@ -471,14 +808,15 @@ def main():
     # logging.debug("{}, {}".format(players, last_date))
     now = datetime.datetime.today()
     now += datetime.timedelta(days=add)  # used to do the simulations on the forum. Should be removed once validated
+    rankings_time = None
     if last_date.date() == now.date():  # "complete" message already posted
         # TODO: do we want to do all the checks (but takes more time...)?
         message = list(clean_message(players, last_date))
     else:
         get_map_histo(muxxu_groups, players)
         # logging.debug(players)
-        ranking_sources, now = get_rankings(muxxu_groups)
-        now += datetime.timedelta(days=add)  # used to do the simulations on the forum. Should be removed once validated
+        ranking_sources, rankings_time = get_rankings(muxxu_groups)
+        now = rankings_time + datetime.timedelta(days=add)  # simulations on the forum. Should be removed once validated
         # logging.debug("{}, {}".format(ranking_sources, now))
         read_ranking_sources(ranking_sources, players, now)
         # logging.debug(players)
@@ -489,6 +827,12 @@ def main():
         print(line)
     time.sleep(1)  # to avoid mixing error messages and the message to be printed
     checks(now, last_date, players)
+    if rankings_time is not None and rankings_time != now:  # the history keeps the real time of the rankings
+        for player in players.values():
+            if now in player.states:
+                player.states[now].time = rankings_time
+                player.states[rankings_time] = player.states.pop(now)
+    save_history(players, args.history, config, threads)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,172 @@
+import datetime
+import os
+
+import pytest
+
+import sante
+
+
+def make_player(muxxu_id, name, states):
+    """ Player with the given states, as a list of (datetime, year, month, health, map)."""
+    player = sante.Player(muxxu_id, muxxu_id + 1000, name)
+    for time_, year, month, health, map_ in states:
+        player.states[time_] = sante.PlayerState(time_, year, month, health, map_=map_)
+    return player
+
+
+@pytest.fixture
+def history(tmp_path):
+    path = str(tmp_path / "historique.sqlite3")
+    players = {
+        1: make_player(1, "Arthur", [(datetime.datetime(2020, 1, 1, 10), 20, 0, 0, 3534),
+                                     (datetime.datetime(2020, 1, 2, 12), 21, 3, 10, None),
+                                     (datetime.datetime(2020, 1, 4, 12), 25, 0, 11, None)]),
+        2: make_player(2, "Arnaud", [(datetime.datetime(2020, 1, 3, 8), 20, 0, 0, 42),
+                                     (datetime.datetime(2020, 1, 4, 12), 22, 0, 1, None)]),
+        3: make_player(3, "Bertrand", [(datetime.datetime(2020, 1, 2, 9), 20, 0, 0, 3534),
+                                       (datetime.datetime(2020, 1, 4, 12), 23, 6, 12, None)]),
+    }
+    sante.save_history(players, path)
+    return path
+
+
+def names(players):
+    return [player.name for player in players]
+
+
+def test_save_same_state_twice_keeps_one_row_and_known_map(history):
+    time_ = datetime.datetime(2020, 1, 1, 10)
+    sante.save_history({1: make_player(1, "Arthur", [(time_, 20, 0, 0, None)])}, history)
+    connection = sante.open_history(history, read_only=True)
+    (player,) = sante.query_player(connection, muxxu_id=1)
+    assert len(player.states) == 3
+    assert player.states[time_].map == 3534
+
+
+def test_query_player_by_name_prefix(history):
+    connection = sante.open_history(history, read_only=True)
+    assert names(sante.query_player(connection, name="Ar")) == ["Arnaud", "Arthur"]
+    assert names(sante.query_player(connection, name="Be")) == ["Bertrand"]
+    assert names(sante.query_player(connection, name="Z")) == []
+    assert names(sante.query_player(connection, twino_id=1003)) == ["Bertrand"]
+
+
+def test_query_births_by_map(history):
+    connection = sante.open_history(history, read_only=True)
+    start, end = datetime.date(2020, 1, 1), datetime.date(2020, 1, 4)
+    assert names(sante.query_births(connection, start, end)) == ["Arnaud", "Arthur", "Bertrand"]
+    assert names(sante.query_births(connection, start, end, 3534)) == ["Arthur", "Bertrand"]
+    assert names(sante.query_births(connection, start, datetime.date(2020, 1, 2), 3534)) == ["Arthur"]
+
+
+def test_query_health_on_a_day_without_post(history):
+    connection = sante.open_history(history, read_only=True)
+    (player,) = sante.query_health(connection, sante.SANTE.index("Bonne santé"), datetime.date(2020, 1, 3))
+    assert player.name == "Arthur"
+    assert list(player.states) == [datetime.datetime(2020, 1, 2, 12)]
+    assert names(sante.query_health(connection, sante.SANTE.index("Bonne santé"), datetime.date(2020, 1, 4))) == []
+    assert names(sante.query_health(connection, 0, datetime.date(2020, 1, 3))) == ["Arnaud", "Bertrand"]
+
+
+def test_query_health_seeks_each_player_instead_of_scanning_states(history):
+    connection = sante.open_history(history, read_only=True)
+    statements = []
+    connection.set_trace_callback(statements.append)
+    sante.query_health(connection, sante.SANTE.index("Bonne santé"), datetime.date(2020, 1, 3))
+    plan = [row[3] for row in connection.execute("EXPLAIN QUERY PLAN " + statements[-1])]
+    assert not any(detail.startswith("SCAN s") or detail.startswith("SCAN states") for detail in plan)
+    assert any("USING PRIMARY KEY" in detail for detail in plan)
+
+
+def fake_render_player(series, path):
+    """ Stands for sante.render_player: counts the renders by adding a line to the file."""
+    with open(path, "a") as f:
+        f.write("rendered\n")
+    return series.muxxu_id, series.digest
+
+
+def fake_render_overview(all_series, path):
+    with open(path, "a") as f:
+        f.write("rendered\n")
+
+
+def render_counts(output):
+    counts = {}
+    for file in os.listdir(output):
+        with open(os.path.join(output, file)) as f:
+            counts[file] = len(f.readlines())
+    return counts
+
+
+@pytest.fixture
+def fake_renders(monkeypatch):
+    monkeypatch.setattr(sante, "render_player", fake_render_player)
+    monkeypatch.setattr(sante, "render_overview", fake_render_overview)
+
+
+def test_report_unchanged_history_renders_nothing(history, tmp_path, fake_renders):
+    output = str(tmp_path / "graphes")
+    sante.report(history, output)
+    assert render_counts(output) == {"1.png": 1, "2.png": 1, "3.png": 1, sante.OVERVIEW_GRAPH: 1}
+    sante.report(history, output)
+    assert render_counts(output) == {"1.png": 1, "2.png": 1, "3.png": 1, sante.OVERVIEW_GRAPH: 1}
+
+
+def test_report_changed_state_renders_only_that_player(history, tmp_path, fake_renders):
+    output = str(tmp_path / "graphes")
+    sante.report(history, output)
+    sante.save_history({2: make_player(2, "Arnaud", [(datetime.datetime(2020, 1, 5, 12), 23, 0, 2, None)])}, history)
+    sante.report(history, output)
+    assert render_counts(output) == {"1.png": 1, "2.png": 2, "3.png": 1, sante.OVERVIEW_GRAPH: 2}
+
+
+def test_report_missing_png_is_rendered_again(history, tmp_path, fake_renders):
+    output = str(tmp_path / "graphes")
+    sante.report(history, output)
+    os.remove(os.path.join(output, "3.png"))
+    sante.report(history, output)
+    assert render_counts(output) == {"1.png": 1, "2.png": 1, "3.png": 1, sante.OVERVIEW_GRAPH: 2}
+
+
+def test_except_set_lookups():
+    excepts = sante.ExceptSet([sante.MessageExcept(s="except : thread 12 page 1 message 2"),
+                               sante.MessageExcept(12, 1, 5), sante.MessageExcept(12, 3, 0)])
+    assert (12, 1, 2) in excepts
+    assert (12, 1, 3) not in excepts
+    assert excepts.positions(12, 1) == {2, 5}
+    assert excepts.positions(12, 3) == {0}
+    assert excepts.positions(12, 2) == frozenset()
+
+
+def test_parse_inputs():
+    config = sante.parse_inputs("groupe muxxu : &quot;pub-1&quot; ; carte : 3534 ; ville : 771130\\nthread : 12\\n"
+                                "thread : 12\\nexcept : thread 12 page 1 message 2")
+    assert config.muxxu_groups == (sante.MuxxuGroup("pub-1", 3534, 771130),)
+    assert config.threads == (12,)
+    assert config.excepts.positions(12, 1) == {2}
+    assert config == sante.parse_inputs("groupe muxxu : &quot;pub-1&quot; ; carte : 3534 ; ville : 771130\\n"
+                                        "thread : 12\\nthread : 12\\nexcept : thread 12 page 1 message 2")
+
+
+@pytest.mark.parametrize("line", ["except : thread 12 page un message 2",
+                                  "groupe muxxu : pub ; carte : 3534"])
+def test_parse_inputs_malformed_line(line):
+    with pytest.raises(ValueError):
+        sante.parse_inputs(line)
+
+
+def forum_message(twino_id, name, muxxu_id, born):
+    return ('{}<span class="user" tid_bg="1" tid_id="{}">{}</span>-{}-20.00 : né le {}'
+            '{}01-01-2020 12:00:00</div>'.format(sante.INTRO, twino_id, name, muxxu_id, born, sante.ENDING))
+
+
+def test_read_forum_sources_skips_excepted_messages():
+    content = (forum_message(11, "Arthur", 1, "01-01-2020 10:00:00")
+               + forum_message(12, "Arnaud", 2, "01-01-2020 11:00:00"))
+    forum_sources = [sante.ForumSource(12, 1, content), sante.ForumSource(12, 2, content)]
+    players, _ = sante.read_forum_sources(forum_sources, sante.ExceptSet([sante.MessageExcept(12, 1, 1)]))
+    assert sorted(players) == [1, 2]
+    (state,) = [state for state in players[2].states.values() if state.source is not None]
+    assert state.source == (12, 2)
+    players, _ = sante.read_forum_sources(forum_sources[:1], sante.ExceptSet([sante.MessageExcept(12, 1, 1)]))
+    assert sorted(players) == [1]